@@ -29,39 +29,128 @@ This architecture correctly enforces the separation you described.
 Final Code with Separate Chat Histories
 Generated python
 import gradio as gr
-import pandas as pd
-import json
+import os
+import asyncio
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import html
+import re
+import time
+import logging
+import functools
+from itertools import islice
 from graph_query_handler1 import GraphQueryHandler
 from data_Structures import Node
-from typing import Dict, List, Any
+from typing import Dict, List, Any, TYPE_CHECKING
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+if TYPE_CHECKING:
+    # pandas is only needed for annotations here; the handler returns ready-made DataFrames
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
 
 # --- Global Setup ---
-custom_theme = gr.themes.Default(primary_hue="blue", secondary_hue="green", neutral_hue="orange", text_size="sm", font="Comic Sans MS")
-title_html = """
-<div style="text-align: center; margin-top:20px;">
-    <h1 style="background: linear-gradient(to right,red,orange,yellow,green,blue,indigo,violet); -webkit-background-clip: text; color:transparent;">
-        Codebase Analytica
-    </h1>
-    <p style="font-size: 18px; color: gray;">Decoding Complexity, One Line at a Time</p>
-</div>
+MAX_DISPLAY = 500  # Upper bound on names pulled into any single list widget
+PAGE_SIZE = 50  # Rows of a result table rendered into a chat message
+MAX_HISTORY_TURNS = 50  # Older turns are dropped from each mode's chat history
+QUERY_CACHE_SIZE = 256  # Distinct guided-mode lookups (classes/methods/dependencies) kept in memory
+QUERY_CACHE_TTL_SECONDS = 300  # ...and for at most this long, so graph rebuilds show up without a Refresh
+METHOD_CACHE_SIZE = 16  # Classes whose method lists are kept; each holds the full source of up to MAX_DISPLAY methods
+MAX_MARKDOWN_CHARS = 20_000  # Longer LLM output is shown as preformatted text instead of parsed markdown
+MAX_EXPLAINED_ENTITIES = 10  # Code elements explained per expert question; each one is an LLM call
+MAX_EXPORT_FILES = 16  # Most recent CSV downloads kept on disk; Gradio serves its own copy of each
+PENDING_EXPLANATION = "*Generating explanation...*"
+TRUNCATED_NOTE = "⚠️ Showing the first {limit} results; refine your selection or question for more."
+
+# Constant component updates, built once and shared by every handler. Gradio only reads them
+# (popping "value", which these do not carry), so the same dicts can be returned on every call.
+SHOW = gr.update(visible=True)
+HIDE = gr.update(visible=False)
+NO_CHANGE = gr.update()
+
+# --- UI choices and Cypher queries (constants, built once at import) ---
+GUIDED_MODE, EXPERT_MODE = "I am new to Marketplace", "I know what I am doing"
+USER_MODES = (GUIDED_MODE, EXPERT_MODE)
+REPOSITORY_ACTIONS = ("LIST CLASSES", "LIST DEPENDENCIES")
+CLASS_ACTIONS = ("SHOW METHODS", "SHOW DEPENDENCIES")
+
+REPOSITORIES_QUERY = "MATCH (n:Repository) RETURN DISTINCT n.name AS name"
+REPOSITORY_CLASSES_QUERY = "MATCH (n:Repository {name: $repository})-[:HAS_CLASSES]->(c:Class) RETURN DISTINCT c.name AS name"
+CLASS_DEPENDENCIES_QUERY = "MATCH (c:Class {name: $class_name})-[:HAS_METHOD]->(m:Method)-[r2:CALLS_METHOD]->(target:Method) RETURN m.name as Method, type(r2) as Action, target.name as CalledMethod LIMIT $limit"
+CLASS_METHODS_QUERY = "MATCH (c:Class {name: $class_name})-[:HAS_METHOD]->(m:Method) RETURN m.name AS name, m.source AS source LIMIT $limit"
+# Only classes and methods carry source code; matching on those labels lets Neo4j seek their name
+# indexes (see graph_builder.INDEXED_LABELS) instead of scanning every node
+ENTITY_SOURCES_QUERY = (
+    "MATCH (n:Class) WHERE n.name IN $names AND n.source IS NOT NULL RETURN n.name AS name, n.source AS source LIMIT $limit "
+    "UNION ALL "
+    "MATCH (n:Method) WHERE n.name IN $names AND n.source IS NOT NULL RETURN n.name AS name, n.source AS source LIMIT $limit"
+)
+# The LLM lists entities comma-separated, sometimes quoted or in backticks
+_ENTITY_SEPARATOR = re.compile(r"[,\n]+")
+_ENTITY_QUOTES = "`'\" \t"
+# Words the LLM occasionally echoes from the prompt instead of a real name
+_NOT_ENTITIES = frozenset({"none", "null", "n/a", "match", "return", "where", "class", "method"})
+
+def _parse_entities(text: str) -> List[str]:
+    """
+    Splits the LLM's entity list into unique names. Names are matched case-sensitively in the
+    graph, so spellings that differ only in case (e.g. a class and its field) are both kept.
+    """
+    entities = []
+    for token in _ENTITY_SEPARATOR.split(text):
+        name = token.strip(_ENTITY_QUOTES)
+        if len(name) >= 2 and name.lower() not in _NOT_ENTITIES:
+            entities.append(name)
+    return list(dict.fromkeys(entities))
+
+# System fonts render immediately; a named font that is not installed falls back and repaints
+custom_theme = gr.themes.Default(primary_hue="blue", secondary_hue="green", neutral_hue="orange", text_size="sm", font=["system-ui", "sans-serif"])
+title_markdown = "# Codebase Analytica\nDecoding Complexity, One Line at a Time"
+# The title's styling lives in the app stylesheet rather than inline HTML that is sanitized on every mount
+title_css = """
+#app-title { text-align: center; margin-top: 20px; }
+#app-title h1 { background: linear-gradient(to right,red,orange,yellow,green,blue,indigo,violet); -webkit-background-clip: text; color: transparent; }
+#app-title p { font-size: 18px; color: gray; }
 """
 
+def ttl_lru_cache(maxsize: int, ttl: float):
+    """
+    functools.lru_cache whose entries expire after at most `ttl` seconds.
+    The current ttl window is part of the cache key, so entries from an earlier
+    window are never hit again and age out of the LRU.
+    """
+    def decorator(fn):
+        cached = functools.lru_cache(maxsize=maxsize)(lambda window, *args: fn(*args))
+        @functools.wraps(fn)
+        def wrapper(*args):
+            return cached(int(time.monotonic() // ttl), *args)
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return decorator
+
 # --- Utility Function to get the query handler ---
-@gr.cache_resource
+# One handler (and so one pooled Neo4j driver) per process
+@functools.lru_cache(maxsize=1)
 def get_query_handler():
     try:
         return GraphQueryHandler()
     except Exception as e:
-        print(f"FATAL: Error connecting to Neo4j: {e}")
+        logger.critical("Error connecting to Neo4j: %s", e)
         gr.Error(f"**Failed to initiate connection to the graph database:** {e}")
         return None
 
 # --- Main Application Logic ---
 query_handler = get_query_handler()
 if not query_handler:
-    with gr.Blocks(theme=custom_theme) as demo:
-        gr.HTML(title_html)
+    with gr.Blocks(theme=custom_theme, css=title_css) as demo:
+        gr.Markdown(title_markdown, elem_id="app-title")
         gr.Error("Could not connect to the database. Please ensure the database is running and check the connection settings, then restart this application.")
     demo.launch()
     import sys
@@ -70,8 +159,8 @@ if not query_handler:
 # ==============================================================================
 # GRADIO UI AND LOGIC
 # ==============================================================================
-with gr.Blocks(theme=custom_theme) as demo:
-    gr.HTML(title_html)
+with gr.Blocks(theme=custom_theme, css=title_css) as demo:
+    gr.Markdown(title_markdown, elem_id="app-title")
 
     # ============================ 1. DEFINE ALL UI COMPONENTS ============================
     with gr.Sidebar():
@@ -81,7 +170,7 @@ with gr.Blocks(theme=custom_theme) as demo:
 
     # --- Initial User Choice ---
     with gr.Row(visible=True) as main_page:
-        user_option = gr.Radio(choices=["I am new to Marketplace", "I know what I am doing"], interactive=True, label="Who are you?")
+        user_option = gr.Radio(choices=list(USER_MODES), interactive=True, label="Who are you?")
 
     # --- CONTAINER FOR "I AM NEW TO MARKETPLACE" MODE ---
     with gr.Column(visible=False) as guided_mode_ui:
@@ -93,19 +182,20 @@ with gr.Blocks(theme=custom_theme) as demo:
         with gr.Column(border=True):
             gr.Markdown("**Follow the steps below:**")
             with gr.Row() as repository_row:
-                query_for_repositories = "MATCH (n:Repository) RETURN DISTINCT n"
-                repository_nodes = query_handler.extract_result_for_query(query_for_repositories)
-                repositories = [x["n"]["name"] for x in repository_nodes] if repository_nodes else []
-                repository_radio = gr.Radio(repositories, label="1. Select Repository", interactive=True)
-            with gr.Row() as repository_action_row:
-                repository_action = gr.Radio(["LIST CLASSES", "LIST DEPENDENCIES"], label="2. What would you like to do?", interactive=True)
-            with gr.Row() as list_class_row:
-                classes_radio_group = gr.Radio(choices=[], label="3. Select a Class", interactive=True)
-            with gr.Row() as class_action_row:
-                class_action_radio_group = gr.Radio(['SHOW METHODS', 'SHOW DEPENDENCIES'], label="4. Select Action for the Class", interactive=True)
-            with gr.Row() as method_row:
-                method_checkbox_group = gr.CheckboxGroup(choices=[], label="5. Select Methods to Explain")
+                repository_radio = gr.Radio([], label="1. Select Repository", interactive=True, scale=7)
+                refresh_repositories_button = gr.Button("🔄 Refresh", size="sm", scale=1)
+            # Later steps start hidden; each handler reveals the next step once its input is chosen
+            with gr.Row(visible=False) as repository_action_row:
+                repository_action = gr.Radio(list(REPOSITORY_ACTIONS), label="2. What would you like to do?", interactive=True)
+            with gr.Row(visible=False) as list_class_row:
+                # Dropdowns are a single filterable control, unlike Radio/CheckboxGroup which render one input per choice
+                classes_radio_group = gr.Dropdown(choices=[], label="3. Select a Class", interactive=True, filterable=True)
+            with gr.Row(visible=False) as class_action_row:
+                class_action_radio_group = gr.Radio(list(CLASS_ACTIONS), label="4. Select Action for the Class", interactive=True)
+            with gr.Row(visible=False) as method_row:
+                method_checkbox_group = gr.Dropdown(choices=[], label="5. Select Methods to Explain", multiselect=True, interactive=True, filterable=True)
                 explain_code_button = gr.Button(variant="primary", value="Explain Selected Code")
+            explanation_panel = gr.Markdown()
 
     # --- CONTAINER FOR "I KNOW WHAT I AM DOING" MODE ---
     with gr.Column(visible=False) as expert_mode_ui:
@@ -116,131 +206,322 @@ with gr.Blocks(theme=custom_theme) as demo:
         with gr.Row():
             expert_question_textbox = gr.Textbox(label="Enter your question:", placeholder="e.g., 'What are the dependencies of the PaymentProcessor class?'", lines=2, scale=7)
             expert_run_button = gr.Button("Run Query", variant="primary", scale=1)
+        # Only the first PAGE_SIZE rows of a table go into the chat; larger results can be downloaded in full
+        expert_download_button = gr.DownloadButton("⬇️ Download full result (CSV)", visible=False)
         clear_expert_history_button = gr.Button("🗑️ Clear Expert Chat", variant="stop")
 
     # ============================ 2. DEFINE ALL HANDLER FUNCTIONS ============================
     
     # --- Helper Functions ---
     def clear_history():
-        return []
+        # Clears both a mode's history state and its chatbot
+        return [], []
+
+    @ttl_lru_cache(maxsize=1, ttl=QUERY_CACHE_TTL_SECONDS)
+    def _load_repositories():
+        return tuple(islice(query_handler.stream_result_for_query(REPOSITORIES_QUERY), MAX_DISPLAY))
+
+    # Guided-mode lookups are read-only and repeat as users click back and forth,
+    # so they are served from memory until they expire or the user refreshes
+    @ttl_lru_cache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL_SECONDS)
+    def _load_classes(repository):
+        return tuple(islice(query_handler.stream_result_for_query(REPOSITORY_CLASSES_QUERY, {"repository": repository}), MAX_DISPLAY))
+
+    @ttl_lru_cache(maxsize=METHOD_CACHE_SIZE, ttl=QUERY_CACHE_TTL_SECONDS)
+    def _load_methods(class_name):
+        # {method_name: source}; the sources come back with the names, so explaining the
+        # selected methods later needs no further round-trip. One row more than is shown is
+        # fetched, so the caller can tell whether the list was cut off
+        rows = query_handler.extract_result_for_query(CLASS_METHODS_QUERY, {"class_name": class_name, "limit": MAX_DISPLAY + 1})
+        return {row["name"]: row["source"] for row in rows}
+
+    @ttl_lru_cache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL_SECONDS)
+    def _load_class_dependencies(class_name):
+        # Rendered once per class; the DataFrame itself is not kept. Only one page is shown,
+        # so only one page (plus a row to tell whether there were more) is fetched
+        result = query_handler.extract_dataframe_for_query(CLASS_DEPENDENCIES_QUERY, {"class_name": class_name, "limit": PAGE_SIZE + 1})
+        if result.empty:
+            return "No dependencies found."
+        note = TRUNCATED_NOTE.format(limit=PAGE_SIZE) + "\n\n" if len(result) > PAGE_SIZE else ""
+        return "### Dependencies Found:\n" + note + _render_table_page(result.head(PAGE_SIZE))
+
+    # The wizard almost always moves on to the next lookup (repository -> classes, class -> methods or
+    # dependencies), so that lookup is started in the background while the user picks the next action.
+    # Exceptions are dropped: the step itself runs the lookup again and reports any error.
+    prefetch_pool = ThreadPoolExecutor(max_workers=2)
+    # (loader, *args) -> Future, for the prefetches started for the latest selection only
+    prefetches = {}
+    prefetches_lock = threading.Lock()
+
+    def _prefetch(*lookups):
+        # Each lookup is a (loader, *args) tuple. A new selection makes the previous one's
+        # prefetches useless, so any that have not started yet are cancelled
+        with prefetches_lock:
+            for future in prefetches.values():
+                future.cancel()
+            prefetches.clear()
+            for loader, *args in lookups:
+                prefetches[(loader, *args)] = prefetch_pool.submit(loader, *args)
+
+    def _lookup(loader, *args):
+        # Waits for a prefetch of the same lookup that is already running rather than querying
+        # Neo4j a second time; one still queued is cancelled and the lookup is run right here
+        with prefetches_lock:
+            future = prefetches.pop((loader, *args), None)
+        if future is not None and not future.cancel():
+            try:
+                return future.result()
+            except Exception:
+                pass
+        return loader(*args)
+
+    def populate_repositories():
+        return gr.update(choices=list(_load_repositories()))
+
+    def refresh_repositories():
+        for loader in (_load_repositories, _load_classes, _load_methods, _load_class_dependencies):
+            loader.cache_clear()
+        # A newly imported repository's classes and methods become answerable in expert mode too
+        query_handler.reset_entity_names()
+        return populate_repositories()
+
+    def _append_turn(history, user_message, bot_message):
+        # Keep only the most recent turns so a long-lived session's state stays bounded
+        history.append([user_message, bot_message])
+        del history[:-MAX_HISTORY_TURNS]
+        return history
+
+    def _render_explanation(text: str) -> str:
+        if len(text) > MAX_MARKDOWN_CHARS:
+            return f"<pre>{html.escape(text)}</pre>"
+        return text
+
+    def _markdown_cell(value) -> str:
+        return str(value).replace("|", "\\|").replace("\n", "<br>")
+
+    def _render_table_page(df: "pd.DataFrame") -> str:
+        # Only the first page is rendered into the chat; the full frame never reaches the browser.
+        # A page is at most PAGE_SIZE rows, so the markdown is built directly rather than through
+        # DataFrame.to_markdown, which goes through tabulate's column-width layout pass.
+        page = df.iloc[:PAGE_SIZE]
+        lines = [
+            "| " + " | ".join(_markdown_cell(column) for column in page.columns) + " |",
+            "|" + " --- |" * len(page.columns),
+        ]
+        lines.extend("| " + " | ".join(_markdown_cell(value) for value in row) + " |" for row in page.itertuples(index=False, name=None))
+        table_md = "\n".join(lines)
+        if len(df) > PAGE_SIZE:
+            table_md += f"\n\n*Showing the first {PAGE_SIZE} of {len(df)} rows.*"
+        return table_md
+
+    # run_query tags every answer with a `kind`; each kind has exactly one renderer
+    RESULT_RENDERERS = {
+        "table": lambda df: "### Query Result\n" + _render_table_page(df),
+        "empty": lambda _: "**Query executed successfully but returned no results.**",
+        "markdown": _render_explanation,
+        "error": lambda message: f"**Error:** {html.escape(str(message))}",
+    }
+
+    # CSV downloads go into one directory that is removed when the process exits, and only the
+    # newest MAX_EXPORT_FILES are kept; Gradio has already copied older ones into its own cache
+    export_dir = tempfile.TemporaryDirectory(prefix="codebase-analytica-")
+    recent_exports = deque()
+    exports_lock = threading.Lock()
+
+    def _export_table(df: "pd.DataFrame") -> str:
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", dir=export_dir.name, delete=False, newline="") as f:
+            df.to_csv(f, index=False)
+        with exports_lock:
+            recent_exports.append(f.name)
+            while len(recent_exports) > MAX_EXPORT_FILES:
+                try:
+                    os.remove(recent_exports.popleft())
+                except FileNotFoundError:
+                    pass
+        return f.name
 
     def _format_expert_response(result_data: Dict[str, Any]) -> str:
-        final_answer = result_data.get("result")
-        response_md = ""
-        if isinstance(final_answer, list) and final_answer:
-            response_md += "### Query Result\n" + pd.DataFrame(final_answer).to_markdown(index=False)
-        elif isinstance(final_answer, list) and not final_answer:
-            response_md += "**Query executed successfully but returned no results.**"
-        response_md += "\n\n---\n<details><summary>Click for Query Execution Details</summary>\n\n"
+        parts = [RESULT_RENDERERS[result_data["kind"]](result_data["result"])]
+        parts.append("\n\n---\n<details><summary>Click for Query Execution Details</summary>\n\n")
+        # Each intermediate step is a single-entry dict such as {"status": "Success"}
         for step in result_data.get('intermediate_steps', []):
-            status_emoji = "✅" if step['status'] == 'Success' else "❌"
-            response_md += f"**{status_emoji} Attempt {step['attempt']}**\n```cypher\n{step['cypher_query']}\n```\n"
-            if step['status'] != 'Success':
-                response_md += f"**Error:** {html.escape(str(step['error']))}\n"
-        response_md += "</details>"
-        return response_md
+            key = next(iter(step)); value = step[key]
+            label = key.replace("_", " ").capitalize()
+            if "cypher" in key:
+                parts.append(f"**{label}**\n```cypher\n{value}\n```\n")
+            else:
+                parts.append(f"**{label}:** {html.escape(str(value))}\n\n")
+        parts.append("</details>")
+        return "".join(parts)
 
     # --- Main Navigation Handler ---
     def navigation(option):
-        is_newbie = (option == "I am new to Marketplace")
-        is_expert = (option == "I know what I am doing")
-        return {
-            main_page: gr.update(visible=False),
-            guided_mode_ui: gr.update(visible=is_newbie),
-            expert_mode_ui: gr.update(visible=is_expert),
-        }
+        is_newbie = (option == GUIDED_MODE)
+        is_expert = (option == EXPERT_MODE)
+        # One update per output, in the order of the listener's outputs
+        return (
+            HIDE,
+            gr.update(visible=is_newbie),
+            gr.update(visible=is_expert),
+        )
+
+    def populate_repositories_for(option):
+        # Repositories are only queried once someone actually opens Guided Mode
+        return populate_repositories() if option == GUIDED_MODE else NO_CHANGE
 
     # --- GUIDED MODE Handlers (update guided_history_state) ---
     def repository_selected_by_user(history, repo_name):
-        history.append([f"Selected Repository: **{repo_name}**", "Great. What would you like to do with this repository?"])
-        return history, gr.update(visible=True, value=None)
+        _prefetch((_load_classes, repo_name))
+        _append_turn(history, f"Selected Repository: **{repo_name}**", "Great. What would you like to do with this repository?")
+        return history, history, gr.update(visible=True, value=None)
 
     def repository_action_selected_by_user(history, repository, action):
         user_message = f"Selected action: **{action}** for repository **{repository}**."
         if action == "LIST CLASSES":
-            result = query_handler.extract_result_for_query(f"MATCH (n:Repository {{name: '{repository}'}})-[:HAS_CLASSES]->(c:Class) RETURN c.name as name")
-            classes = [x["name"] for x in result] if result else []
-            bot_message = "Okay, here are the classes I found:\n\n* " + "\n* ".join(classes) if classes else "I couldn't find any classes."
-            history.append([user_message, bot_message])
-            return history, gr.update(visible=True), gr.update(choices=classes, value=None)
+            classes = list(_lookup(_load_classes, repository))
+            bot_message = "Okay, here are the classes I found:\n\n* " + "\n* ".join(html.escape(c) for c in classes) if classes else "I couldn't find any classes."
+            _append_turn(history, user_message, bot_message)
+            return history, history, SHOW, gr.update(choices=classes, value=None)
         elif action == "LIST DEPENDENCIES":
-            history.append([user_message, "To see dependencies, please select a specific class first."])
-            return history, gr.update(visible=False, value=None), gr.update(choices=[], value=None)
+            _append_turn(history, user_message, "To see dependencies, please select a specific class first.")
+            return history, history, gr.update(visible=False, value=None), gr.update(choices=[], value=None)
 
     def class_selected_by_user(history, class_name):
-        history.append([f"Selected Class: **{class_name}**", f"Class `{class_name}` selected. What action next?"])
-        return history, gr.update(visible=True, value=None)
+        _prefetch((_load_methods, class_name), (_load_class_dependencies, class_name))
+        _append_turn(history, f"Selected Class: **{class_name}**", f"Class `{class_name}` selected. What action next?")
+        return history, history, gr.update(visible=True, value=None)
 
-    def class_action_selected_by_user(history, class_name, action, progress=gr.Progress(track_tqdm=True)):
+    def class_action_selected_by_user(history, class_name, action):
         user_message = f"Requested **{action}** for class **{class_name}**."
-        if not class_name: gr.Warning("Please select a class first!"); return history, gr.update(visible=False), gr.update(choices=[])
+        if not class_name:
+            # gr.Warning is only shown for queued events, and this step is answered directly
+            _append_turn(history, user_message, "Please select a class first!")
+            return history, history, HIDE, gr.update(choices=[])
         
         if action == "SHOW DEPENDENCIES":
-            result = query_handler.extract_result_for_query(f"MATCH (c:Class {{name : '{class_name}'}})-[:HAS_METHOD]->(m:Method)-[r2:CALLS_METHOD]->(target:Method) RETURN m.name as Method, type(r2) as Action, target.name as CalledMethod")
-            bot_message = "### Dependencies Found:\n" + pd.DataFrame(result).to_markdown(index=False) if result else "No dependencies found."
-            history.append([user_message, bot_message])
-            return history, gr.update(visible=False), gr.update(choices=[], value=None)
+            _append_turn(history, user_message, _lookup(_load_class_dependencies, class_name))
+            return history, history, HIDE, gr.update(choices=[], value=None)
         elif action == "SHOW METHODS":
-            result = query_handler.extract_result_for_query(f"MATCH (c:Class {{name : '{class_name}'}})-[:HAS_METHOD]->(m:Method) RETURN m.name as name")
-            methods = [x["name"] for x in result] if result else []
-            history.append([user_message, "Here are the methods. You can select some to explain."])
-            return history, gr.update(visible=True), gr.update(choices=methods, value=None)
-
-    def explain_code_button_handler(history, selected_methods, class_name):
-        if not selected_methods: gr.Warning("Please select at least one method."); return history
+            methods = list(_lookup(_load_methods, class_name))
+            bot_message = "Here are the methods. You can select some to explain."
+            if len(methods) > MAX_DISPLAY:
+                bot_message += "\n\n" + TRUNCATED_NOTE.format(limit=MAX_DISPLAY)
+                methods = methods[:MAX_DISPLAY]
+            _append_turn(history, user_message, bot_message)
+            return history, history, SHOW, gr.update(choices=methods, value=None)
+
+    def explain_code_button_handler(history, selected_methods, class_name, progress=gr.Progress()):
+        if not selected_methods: gr.Warning("Please select at least one method."); yield history, NO_CHANGE, ""; return
         user_message = f"Requested explanation for method(s): **{', '.join(selected_methods)}**"
-        bot_responses = []
-        for method in selected_methods:
-            query = f"MATCH (c:Class {{name: '{class_name}'}})-[:HAS_METHOD]->(m:Method {{name: '{method}'}}) RETURN m.source as source"
-            result = query_handler.extract_result_for_query(query)
-            if result and "source" in result[0]:
-                source_code, explanation = result[0]["source"], query_handler.explain_code(result[0]["source"])
-                bot_responses.append(f"### Explanation for `{method}`\n```python\n{html.escape(source_code)}\n```\n{explanation}")
-            else: bot_responses.append(f"Could not retrieve source code for `{method}`.")
-        history.append([user_message, "\n\n---\n\n".join(bot_responses)])
-        return history
+        found = _lookup(_load_methods, class_name)
+        sources = {m: found[m] for m in selected_methods if found.get(m) is not None}
+        bot_responses = {m: f"Could not retrieve source code for `{m}`." for m in selected_methods if m not in sources}
+        # The LLM calls run concurrently and each explanation is shown as soon as it is ready, in whatever
+        # order they finish. While streaming only the explanation panel is re-sent; the chatbot is
+        # updated once at the end. Updates are positional tuples in the listener's output order.
+        methods = list(sources)
+        completed = query_handler.explain_codes_as_completed(list(sources.values()))
+        for index, explanation in progress.tqdm(completed, total=len(methods), desc="Explaining methods"):
+            method = methods[index]
+            bot_responses[method] = f"### Explanation for `{method}`\n```python\n{html.escape(sources[method])}\n```\n{_render_explanation(explanation)}"
+            yield history, NO_CHANGE, "\n\n---\n\n".join(bot_responses[m] for m in selected_methods if m in bot_responses)
+        _append_turn(history, user_message, "\n\n---\n\n".join(bot_responses[m] for m in selected_methods))
+        yield history, history, ""
 
     # --- EXPERT MODE Handler (updates expert_history_state) ---
-    def handle_expert_chat(question, history, progress=gr.Progress(track_tqdm=True)):
-        if not question or not question.strip(): return "", history
-        history.append([question, None]); yield "", history
+    async def _explain_at(index, source):
+        return index, await query_handler.aexplain_code(source)
+
+    # Async so that while one session waits on Neo4j or the LLM, the event loop keeps serving the others
+    async def handle_expert_chat(question, history, progress=gr.Progress(track_tqdm=True)):
+        if not question or not question.strip(): yield "", history, history, NO_CHANGE; return
+        # The previous answer's download (if any) is hidden until this answer provides its own
+        _append_turn(history, question, None); yield "", history, history, HIDE
+        download = NO_CHANGE
         try:
-            intent = json.loads(query_handler.identify_intent(question)).get("intent", "entity")
+            # Intent and entities come from one analysis step; the entities are simply unused for dependency questions
+            intent_json, entities_text = await query_handler.aanalyze_question(question)
+            intent = json_loads(intent_json).get("intent", "entity")
             if intent == "dependency":
-                result_data = query_handler.run_query(question)
+                result_data = await query_handler.arun_query(question)
                 history[-1][1] = _format_expert_response(result_data)
+                if result_data["kind"] == "table" and len(result_data["result"]) > PAGE_SIZE:
+                    download = gr.update(value=await asyncio.to_thread(_export_table, result_data["result"]), visible=True)
             else:
-                entities = [e.strip() for e in query_handler.extract_entities(question).split(",") if e.strip()]
-                result = query_handler.extract_result_for_query(f"WITH {json.dumps(entities)} AS names MATCH (n) WHERE n.name IN names RETURN n")
-                if not result: history[-1][1] = "Could not find any matching code elements."
+                entities = _parse_entities(entities_text)
+                # Project only the two columns used below instead of whole nodes, and walk them column-wise
+                nodes = await query_handler.aextract_dataframe_for_query(ENTITY_SOURCES_QUERY, {"names": entities, "limit": MAX_EXPLAINED_ENTITIES + 1})
+                if nodes.empty: history[-1][1] = "Could not find any matching code elements."
                 else:
-                    explanations = []
-                    for item in result:
-                        node = item.get("n", {})
-                        if 'source' in node and 'name' in node:
-                            explanation = query_handler.explain_code(node["source"])
-                            explanations.append(f"### Explanation for `{html.escape(node['name'])}`\n```python\n{html.escape(node['source'])}\n```\n{explanation}")
-                    history[-1][1] = "\n\n---\n\n".join(explanations)
+                    # One row more than is explained is fetched, so a result with exactly the limit is not
+                    # reported as truncated; each label is limited separately, so the rows are capped here
+                    truncated = len(nodes) > MAX_EXPLAINED_ENTITIES
+                    nodes = nodes.head(MAX_EXPLAINED_ENTITIES)
+                    names, sources = nodes["name"].to_numpy(), nodes["source"].to_numpy()
+                    headers = [f"### Explanation for `{html.escape(name)}`\n```python\n{html.escape(source)}\n```\n" for name, source in zip(names, sources)]
+                    # The other entities are sent to the LLM right away and explained concurrently
+                    # while the first one streams, instead of one after another
+                    remaining = [asyncio.ensure_future(_explain_at(i, source)) for i, source in enumerate(sources[1:], start=1)]
+                    try:
+                        # Every entity's code is shown straight away, with its explanation filled in when ready
+                        parts = [header + PENDING_EXPLANATION for header in headers]
+                        history[-1][1] = "\n\n---\n\n".join(parts)
+                        yield "", history, history, NO_CHANGE
+                        # Tokens are shown as the LLM produces them instead of after the full explanation.
+                        # The other sections do not change while the first one streams, so they are joined
+                        # once up front rather than re-joined (along with every chunk so far) per token
+                        rest = "".join("\n\n---\n\n" + part for part in parts[1:])
+                        explanation = ""
+                        async for chunk in query_handler.aexplain_code_stream(sources[0]):
+                            explanation += chunk
+                            history[-1][1] = headers[0] + explanation + rest
+                            yield "", history, history, NO_CHANGE
+                        parts[0] = headers[0] + _render_explanation(explanation)
+                        # ...and filled in in the order they finish, so one slow entity does not hold back the rest
+                        for task in progress.tqdm(asyncio.as_completed(remaining), total=len(remaining), desc="Explaining entities"):
+                            i, explanation = await task
+                            parts[i] = headers[i] + _render_explanation(explanation)
+                            history[-1][1] = "\n\n---\n\n".join(parts)
+                            yield "", history, history, NO_CHANGE
+                    finally:
+                        # Explanations still running when the answer fails or the client goes away
+                        # would otherwise keep occupying the LLM pool; failures of tasks that already
+                        # finished are marked as retrieved so they are not logged as unhandled
+                        for task in remaining:
+                            if not task.cancel() and not task.cancelled():
+                                task.exception()
+                    if truncated:
+                        parts.append(TRUNCATED_NOTE.format(limit=MAX_EXPLAINED_ENTITIES))
+                    history[-1][1] = "\n\n---\n\n".join(parts)
         except Exception as e:
             gr.Error(f"An error occurred: {e}"); history[-1][1] = f"Sorry, an error occurred: {html.escape(str(e))}"
-        yield "", history
+        yield "", history, history, download
 
     # ============================ 3. DEFINE ALL EVENT LISTENERS ============================
-    user_option.change(fn=navigation, inputs=user_option, outputs=[main_page, guided_mode_ui, expert_mode_ui])
+    # The mode switch is shown straight away; the repository list is filled in by a follow-up event
+    user_option.input(fn=navigation, inputs=user_option, outputs=[main_page, guided_mode_ui, expert_mode_ui], queue=False).then(
+        fn=populate_repositories_for, inputs=user_option, outputs=repository_radio, queue=False)
 
     # --- Listeners for Guided Mode ---
-    clear_guided_history_button.click(fn=clear_history, outputs=[guided_history_state])
-    guided_history_state.change(fn=lambda h: h, inputs=guided_history_state, outputs=guided_chatbot)
-    repository_radio.change(fn=repository_selected_by_user, inputs=[guided_history_state, repository_radio], outputs=[guided_history_state, repository_action_row])
-    repository_action.change(fn=repository_action_selected_by_user, inputs=[guided_history_state, repository_radio, repository_action], outputs=[guided_history_state, list_class_row, classes_radio_group])
-    classes_radio_group.change(fn=class_selected_by_user, inputs=[guided_history_state, classes_radio_group], outputs=[guided_history_state, class_action_row])
-    class_action_radio_group.change(fn=class_action_selected_by_user, inputs=[guided_history_state, classes_radio_group, class_action_radio_group], outputs=[guided_history_state, method_row, method_checkbox_group])
-    explain_code_button.click(fn=explain_code_button_handler, inputs=[guided_history_state, method_checkbox_group, classes_radio_group], outputs=[guided_history_state])
+    refresh_repositories_button.click(fn=refresh_repositories, outputs=[repository_radio])
+    # Each step writes the chatbot itself instead of relaying guided_history_state.change into it, and the
+    # wizard listens on .input (user selections only), so the value resets a step returns for the next
+    # control do not fire that control's handler as an extra event.
+    # Steps that only update widgets or read the cached lookups skip the queue (queue=False) and are answered
+    # directly; only the LLM-backed handlers are queued
+    clear_guided_history_button.click(fn=clear_history, outputs=[guided_history_state, guided_chatbot], queue=False)
+    repository_radio.input(fn=repository_selected_by_user, inputs=[guided_history_state, repository_radio], outputs=[guided_history_state, guided_chatbot, repository_action_row], queue=False)
+    repository_action.input(fn=repository_action_selected_by_user, inputs=[guided_history_state, repository_radio, repository_action], outputs=[guided_history_state, guided_chatbot, list_class_row, classes_radio_group], queue=False)
+    classes_radio_group.input(fn=class_selected_by_user, inputs=[guided_history_state, classes_radio_group], outputs=[guided_history_state, guided_chatbot, class_action_row], queue=False)
+    class_action_radio_group.input(fn=class_action_selected_by_user, inputs=[guided_history_state, classes_radio_group, class_action_radio_group], outputs=[guided_history_state, guided_chatbot, method_row, method_checkbox_group], queue=False)
+    explain_code_button.click(fn=explain_code_button_handler, inputs=[guided_history_state, method_checkbox_group, classes_radio_group], outputs=[guided_history_state, guided_chatbot, explanation_panel], show_progress="minimal")
 
     # --- Listeners for Expert Mode ---
-    clear_expert_history_button.click(fn=clear_history, outputs=[expert_history_state])
-    expert_history_state.change(fn=lambda h: h, inputs=expert_history_state, outputs=expert_chatbot)
-    expert_run_button.click(fn=handle_expert_chat, inputs=[expert_question_textbox, expert_history_state], outputs=[expert_question_textbox, expert_history_state])
-    expert_question_textbox.submit(fn=handle_expert_chat, inputs=[expert_question_textbox, expert_history_state], outputs=[expert_question_textbox, expert_history_state])
+    # The handler writes the chatbot directly rather than relaying every state change into it, so each
+    # streamed token is one update that Gradio can send as a diff instead of a second event re-sending the whole history
+    # The streaming handlers use the minimal progress indicator, so the partial answer is not hidden under the loading overlay
+    clear_expert_history_button.click(fn=clear_history, outputs=[expert_history_state, expert_chatbot], queue=False)
+    expert_run_button.click(fn=handle_expert_chat, inputs=[expert_question_textbox, expert_history_state], outputs=[expert_question_textbox, expert_history_state, expert_chatbot, expert_download_button], trigger_mode="once", show_progress="minimal")
+    expert_question_textbox.submit(fn=handle_expert_chat, inputs=[expert_question_textbox, expert_history_state], outputs=[expert_question_textbox, expert_history_state, expert_chatbot, expert_download_button], trigger_mode="once", show_progress="minimal")
 
 demo.launch(debug=True)
@@ -2,6 +2,7 @@
 
 import json
 import os
+import logging
 import warnings
 from neo4j import GraphDatabase, Auth
 from dataclasses import dataclass, asdict, field
@@ -17,6 +18,12 @@ NEO4J_USER = os.getenv("NEO4J_USERNAME", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "password")
 SEMANTIC_MODEL_DIR = "semantic_models"
 
+# Node labels that get an index on `name`. The builder's MERGEs and the app's lookups
+# both match nodes by name, which is a full label scan without an index.
+INDEXED_LABELS = ("Repository", "Class", "Method", "Controller", "StoredProcedure")
+
+logger = logging.getLogger(__name__)
+
 # Suppress only deprecation warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
@@ -124,23 +131,30 @@ class NeoGraphBuilder:
         try:
             self.driver = GraphDatabase.driver(uri, auth=(user, password))
             self.driver.verify_connectivity()
-            print("Successfully connected to Neo4j.")
+            logger.info("Successfully connected to Neo4j.")
         except Exception as e:
-            print(f"Failed to connect to Neo4j: {e}")
+            logger.error("Failed to connect to Neo4j: %s", e)
             self.driver = None
 
     def close(self):
         if self.driver:
             self.driver.close()
-            print("Neo4j connection closed.")
+            logger.info("Neo4j connection closed.")
 
     def clear_graph(self):
         """Deletes all nodes and relationships in the graph."""
         if not self.driver: return
-        print("Clearing the graph...")
+        logger.info("Clearing the graph...")
         with self.driver.session() as session:
             session.run("MATCH (n) DETACH DELETE n")
-        print("Graph cleared.")
+        logger.info("Graph cleared.")
+
+    def create_indexes(self):
+        """Creates the `name` indexes for INDEXED_LABELS; labels that already have one are skipped."""
+        if not self.driver: return
+        with self.driver.session() as session:
+            for label in INDEXED_LABELS:
+                session.run(f"CREATE INDEX {label.lower()}_name IF NOT EXISTS FOR (n:{label}) ON (n.name)")
 
     ### --- CHANGE --- ###
     # This single method replaces all the repetitive create_*_node methods.
@@ -168,27 +182,35 @@ class NeoGraphBuilder:
         result = session.run(query, properties=properties)
         return result.single()["node_id"]
 
-    def create_relationship(self, from_id, to_id, relationship: RelationshipType):
-        """Creates a relationship between two nodes, preventing duplicates."""
+    def create_relationship(self, from_id, to_id, relationship: RelationshipType, session=None):
+        """
+        Creates a relationship between two nodes, preventing duplicates.
+        Pass an open `session` to run on it; otherwise a new session is opened for the call.
+        """
         if not self.driver: return
+        # Using MERGE on relationships prevents creating duplicates.
+        query = (
+            f"MATCH (a) WHERE id(a) = $from_id "
+            f"MATCH (b) WHERE id(b) = $to_id "
+            f"MERGE (a)-[r:{relationship.value}]->(b) "
+            "RETURN r"
+        )
+        if session is not None:
+            session.run(query, from_id=from_id, to_id=to_id)
+            return
         with self.driver.session() as session:
-            # Using MERGE on relationships prevents creating duplicates.
-            query = (
-                f"MATCH (a) WHERE id(a) = $from_id "
-                f"MATCH (b) WHERE id(b) = $to_id "
-                f"MERGE (a)-[r:{relationship.value}]->(b) "
-                "RETURN r"
-            )
             session.run(query, from_id=from_id, to_id=to_id)
             
     def run_build_process(self, model_files: List[str]):
         if not self.driver:
-            print("Cannot run build process, no database connection.")
+            logger.error("Cannot run build process, no database connection.")
             return
 
+        self.create_indexes()
+
         with self.driver.session() as session:
             for file_path in model_files:
-                print(f"Processing {file_path}...")
+                logger.info("Processing %s...", file_path)
                 with open(file_path) as f:
                     model_dict = json.load(f)
 
@@ -201,7 +223,7 @@ class NeoGraphBuilder:
                 for item in model_dict.get("DependentRepositories", []):
                     dep_repo_node = RepoNode(name=item.lower())
                     dep_repo_id = self._create_or_update_node(session, dep_repo_node)
-                    self.create_relationship(repo_id, dep_repo_id, RelationshipType.DEPENDS_ON)
+                    self.create_relationship(repo_id, dep_repo_id, RelationshipType.DEPENDS_ON, session)
                 
                 # --- Controllers ---
                 for item in model_dict.get("Controllers", []):
@@ -209,7 +231,7 @@ class NeoGraphBuilder:
                     name = item["Name"].replace('"', '')
                     ctrl_node = ControllerNode(name=name)
                     ctrl_id = self._create_or_update_node(session, ctrl_node)
-                    self.create_relationship(repo_id, ctrl_id, RelationshipType.HAS_ROUTES)
+                    self.create_relationship(repo_id, ctrl_id, RelationshipType.HAS_ROUTES, session)
 
                 # --- Class Details ---
                 for class_item in model_dict.get("ClassDetails", []):
@@ -220,7 +242,7 @@ class NeoGraphBuilder:
                         ds=bool(class_item.get("Methods"))
                     )
                     class_id = self._create_or_update_node(session, class_node)
-                    self.create_relationship(repo_id, class_id, RelationshipType.HAS_CLASSES)
+                    self.create_relationship(repo_id, class_id, RelationshipType.HAS_CLASSES, session)
                     
                     # Stored Procedures
                     for sp in class_item.get("StoredProcedure", []):
@@ -229,7 +251,7 @@ class NeoGraphBuilder:
                         cleaned_name = sp.strip('[]"\' ').split('.')[-1]
                         sp_node = StoredProcedureNode(name=cleaned_name)
                         sp_id = self._create_or_update_node(session, sp_node)
-                        self.create_relationship(class_id, sp_id, RelationshipType.CALLS_SP)
+                        self.create_relationship(class_id, sp_id, RelationshipType.CALLS_SP, session)
 
                     # Methods within the class
                     for method_item in class_item.get("Methods", []):
@@ -239,19 +261,20 @@ class NeoGraphBuilder:
                             return_type=method_item.get("MethodReturnType", "void")
                         )
                         method_id = self._create_or_update_node(session, method_node)
-                        self.create_relationship(class_id, method_id, RelationshipType.HAS_METHOD)
+                        self.create_relationship(class_id, method_id, RelationshipType.HAS_METHOD, session)
 
 
 def main():
     """Main execution function."""
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     if not os.path.exists(SEMANTIC_MODEL_DIR):
-        print(f"Error: Directory '{SEMANTIC_MODEL_DIR}' not found.")
-        print("Please create it and place your JSON AST files inside.")
+        logger.error("Error: Directory '%s' not found.", SEMANTIC_MODEL_DIR)
+        logger.error("Please create it and place your JSON AST files inside.")
         return
 
     files = [os.path.join(SEMANTIC_MODEL_DIR, f) for f in os.listdir(SEMANTIC_MODEL_DIR) if f.endswith('.json')]
     if not files:
-        print(f"No JSON files found in '{SEMANTIC_MODEL_DIR}'.")
+        logger.error("No JSON files found in '%s'.", SEMANTIC_MODEL_DIR)
         return
 
     builder = NeoGraphBuilder(uri=NEO4J_URI, user=NEO4J_USER, password=NEO4J_PASSWORD)
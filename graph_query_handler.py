@@ -1,11 +1,62 @@
 # graph_query_handler.py
 
 import os
+import re
+import json
 import time
-from langchain_community.graphs import Neo4jGraph
-from langchain.prompts import PromptTemplate
-from langchain_community.llms import Ollama
-from langchain_core.output_parsers import StrOutputParser
+import asyncio
+import string
+import logging
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING
+from neo4j import GraphDatabase, READ_ACCESS
+from ollama_client import OllamaClient, PromptTooLongError
+
+if TYPE_CHECKING:
+    # pandas is imported by the driver's Result.to_df() on first use, not at module import
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Number of records the driver pulls from the server per batch when streaming results.
+FETCH_SIZE = 1000
+
+# Cache for answered natural-language questions, keyed on (question, schema_version).
+QUERY_CACHE_SIZE = 128
+QUERY_CACHE_TTL_SECONDS = 600
+QUERY_CACHE_MAX_ROWS = 1000  # Larger tabular answers are not worth holding in memory
+
+# Number of characters of a streamed Cypher completion inspected before deciding whether
+# it is a query at all; replies that open with prose are abandoned at that point.
+CYPHER_HEAD_CHARS = 16
+
+# Cache for raw LLM completions, keyed on a hash of the prompt. Prompts are sent with
+# temperature 0, so the same prompt always produces the same completion.
+LLM_CACHE_SIZE = 1024
+# Completions are also written to this SQLite file so they survive restarts; set it to "" to disable.
+LLM_DISK_CACHE_PATH = os.getenv("LLM_DISK_CACHE_PATH", ".llm_cache.sqlite3")
+LLM_DISK_CACHE_TTL_SECONDS = 7 * 24 * 3600  # On-disk completions older than this are generated again
+
+# Upper bound on LLM calls the handler runs concurrently (e.g. explaining several methods).
+LLM_MAX_WORKERS = 4
+
+# Shown in place of an explanation when the source does not fit in the model's context window
+SOURCE_TOO_LARGE_EXPLANATION = "*This source is too large to explain in a single request.*"
+
+# Connection pool for the handler's single Neo4j driver, shared by every UI session.
+NEO4J_MAX_CONNECTION_POOL_SIZE = 50
+NEO4J_CONNECTION_ACQUISITION_TIMEOUT = 30  # seconds
+
+# Schema summaries are shared by every handler connected to the same database and
+# refreshed after this long, so new handlers skip the db.labels()/relationshipTypes() calls.
+SCHEMA_CACHE_TTL_SECONDS = 600
+# Entity names change whenever a repository is imported, so the pattern built from them
+# (including "no names yet") is rebuilt after this long even without an explicit reset.
+ENTITY_NAMES_TTL_SECONDS = 300
 
 ### NEW: PROMPT TEMPLATES FOR THE NEW PIPELINE ###
 
@@ -77,66 +128,726 @@ Your task is to explain a method's functionality based on its source code.
 Explanation:
 """
 
+# 4. Error Correction Prompt: Appended to the Cypher prompt when the previous attempt was rejected,
+# so a retry is not just the same prompt (and, at temperature 0, the same query) again.
+ERROR_CORRECTION_TEMPLATE = """
+Your previous query was:
+{query}
+
+It was rejected with this error:
+{error}
+
+Write a corrected Cypher query. Your response MUST be ONLY the Cypher query.
+"""
+
+# 5. Intent Prompt: Splits expert-mode questions into dependency questions and questions about specific entities.
+INTENT_TEMPLATE = """
+You are an expert at classifying user questions about a software codebase.
+Your task is to categorize the user's question into one of two types:
+
+1. `dependency`: The user is asking how repositories, classes or methods relate to each other
+   (what depends on, calls, or contains what).
+
+2. `entity`: The user is asking about one or more specific code entities, e.g. to explain or show them.
+
+<QUESTION>
+{question}
+</QUESTION>
+
+Provide one of the two category labels and nothing else.
+"""
+
+# 6. Question Analysis Prompt: Intent classification and entity extraction packed into one request,
+# used when the question names no known entity verbatim, so it costs one LLM round-trip instead of two.
+ANALYZE_QUESTION_TEMPLATE = """
+You are an expert at reading questions about a software codebase. Answer two tasks about the question below.
+
+Task 1: Categorize the question as one of:
+- `dependency`: it asks how repositories, classes or methods relate to each other (what depends on, calls, or contains what).
+- `entity`: it asks about one or more specific code entities, e.g. to explain or show them.
+
+Task 2: Extract the names of the code entities (classes, methods, controllers, etc.) the question refers to.
+
+<QUESTION>
+{question}
+</QUESTION>
+
+Respond with exactly these two lines and nothing else:
+intent: <dependency or entity>
+entities: <comma-separated entity names, or none>
+"""
+
+# Names of all entities with stored source code, used to match questions without the LLM.
+ENTITY_NAMES_QUERY = "MATCH (n) WHERE n.source IS NOT NULL AND n.name IS NOT NULL RETURN DISTINCT n.name AS name"
+LABELS_QUERY = "CALL db.labels() YIELD label RETURN label"
+RELATIONSHIP_TYPES_QUERY = "CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType"
+
+# Few-shot examples for the cypher_lookup path. They never change, so the text
+# injected into CYPHER_GENERATION_TEMPLATE is rendered once at import.
+CYPHER_EXAMPLES = (
+    { "question": "Find all classes in the repository 'exampleRepo'.", "query": "MATCH (r:Repository {name: 'exampleRepo'})-[:HAS_CLASSES]->(c:Class) RETURN c.name AS ClassName, c.file_path AS FilePath" },
+    { "question": "Which repositories depend on 'core-library'?", "query": "MATCH (r:Repository)-[:DEPENDS_ON]->(:Repository {name: 'core-library'}) RETURN r.name AS DependentRepository" },
+    { "question": "What are the controllers in 'api-gateway'?", "query": "MATCH (:Repository {name: 'api-gateway'})-[:HAS_ROUTES]->(c:Controller) RETURN c.name AS ControllerName" },
+)
+CYPHER_EXAMPLES_TEXT = "\n\n".join(f"Question: {ex['question']}\nCypher: {ex['query']}" for ex in CYPHER_EXAMPLES)
+
+def compile_template(template: str) -> tuple:
+    """
+    Parses a str.format template once into (literal_text, field_name) pairs.
+    field_name is None for the trailing literal; escaped braces are already resolved.
+    """
+    return tuple((literal, field) for literal, field, _, _ in string.Formatter().parse(template))
+
+def bind_template(compiled: tuple, **values) -> tuple:
+    """
+    Partially renders a compiled template: the given fields are folded into the
+    surrounding literal text, the rest stay as placeholders for render_template.
+    """
+    bound = []
+    pending = ""
+    for literal, field in compiled:
+        pending += literal
+        if field in values:
+            pending += str(values[field])
+        else:
+            bound.append((pending, field))
+            pending = ""
+    if pending:
+        bound.append((pending, None))
+    return tuple(bound)
+
+def render_template(compiled: tuple, **values) -> str:
+    """Fills the remaining fields of a compiled template."""
+    return "".join(literal if field is None else literal + str(values[field]) for literal, field in compiled)
+
+ROUTER_PROMPT = compile_template(ROUTER_TEMPLATE)
+CYPHER_GENERATION_PROMPT = compile_template(CYPHER_GENERATION_TEMPLATE)
+EXPLANATION_PROMPT = compile_template(EXPLANATION_TEMPLATE)
+ERROR_CORRECTION_PROMPT = compile_template(ERROR_CORRECTION_TEMPLATE)
+INTENT_PROMPT = compile_template(INTENT_TEMPLATE)
+ANALYZE_QUESTION_PROMPT = compile_template(ANALYZE_QUESTION_TEMPLATE)
+
+# The router prompt shows its labels in backticks, and the model often echoes them that way
+_ROUTER_LABEL = re.compile(r"\b(cypher_lookup|method_explanation)\b")
+# identify_intent can only return one of two answers, so both are serialized once here
+_INTENT_RESPONSES = {intent: json.dumps({"intent": intent}) for intent in ("dependency", "entity")}
+# One "intent: ..." / "entities: ..." line of an ANALYZE_QUESTION_PROMPT reply
+_ANALYSIS_FIELD = re.compile(r"^\W*(intent|entities)\W*:\s*(.*?)\s*$", re.IGNORECASE | re.MULTILINE)
+# Wording that almost always means a dependency question; these are classified without asking the LLM
+_DEPENDENCY_QUESTION = re.compile(r"\b(?:depend\w*|calls?|called|callers?|uses|used\s+by|imports?)\b", re.IGNORECASE)
+# Stands in for the entity pattern of a graph with no entity names; it never matches, and caching
+# it keeps every question from re-running the name scan until the schema is refreshed
+_NO_ENTITY_NAMES = re.compile(r"(?!)")
+_CODE_FENCE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_CYPHER_START = re.compile(r"^(MATCH|OPTIONAL\s+MATCH|CREATE|MERGE|CALL|WITH|RETURN|UNWIND)\b", re.IGNORECASE)
+_BRACKET_PAIRS = {")": "(", "]": "[", "}": "{"}
+_CYPHER_START_ERROR = "The query must start with a Cypher clause such as MATCH, CALL, WITH or RETURN."
+
+def _strip_code_fences(text: str) -> str:
+    """Removes the ```cypher ... ``` fences LLMs tend to wrap queries in."""
+    return _CODE_FENCE.sub("", text.strip()).strip()
+
+# Quoted string literals, including any escaped quotes inside them
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+# String literals, backtick identifiers and comments. Whichever starts first wins (e.g. a quote
+# inside a comment), so scanning with this finds the real literals and skips everything else
+_NON_CODE = re.compile(_STRING_LITERAL.pattern + r"|`[^`]*`|//[^\n]*|/\*.*?\*/", re.DOTALL)
+
+def _parameterize_literals(query: str) -> tuple:
+    """
+    Replaces the string literals in an LLM-generated query with $parameters.
+    Questions that differ only in the names they mention then produce the same query
+    text, so Neo4j reuses its cached plan instead of planning every query from scratch.
+    Returns (query, params).
+    """
+    params = {}
+    def to_parameter(match):
+        literal = match.group(0)
+        if literal[0] not in "'\"":
+            # A comment or backtick identifier; a quote inside it is not a literal
+            return literal
+        if "\\" in literal:
+            # Escape sequences are left for Neo4j to interpret
+            return literal
+        name = f"lit{len(params)}"
+        params[name] = literal[1:-1]
+        return f"${name}"
+    return _NON_CODE.sub(to_parameter, query), params
+
+def _cheap_cypher_sanity(query: str):
+    """
+    Rejects obviously malformed Cypher without a round-trip to Neo4j.
+    Returns an error message, or None if the query looks plausible.
+    """
+    if not _CYPHER_START.match(query):
+        return _CYPHER_START_ERROR
+    if "```" in query:
+        return "The query must not contain markdown code fences."
+    code = _NON_CODE.sub(" ", query)
+    # Any quote left over opens a string or identifier that is never closed
+    if any(quote in code for quote in "'\"`"):
+        return "The query has an unterminated string or identifier."
+    stack = []
+    for char in code:
+        if char in "([{":
+            stack.append(char)
+        elif char in _BRACKET_PAIRS:
+            if not stack or stack.pop() != _BRACKET_PAIRS[char]:
+                return f"Unbalanced '{char}' in the query."
+    if stack:
+        return "The query has an unterminated bracket."
+    return None
+
+class LRUCache:
+    """
+    A small thread-safe LRU cache with an optional time-to-live per entry.
+    Once `maxsize` entries are stored, the least recently used one is evicted.
+    """
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 128, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value, expires_at = self._data.get(key, (self._MISSING, None))
+            if value is self._MISSING:
+                return default
+            if expires_at is not None and time.time() >= expires_at:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            expires_at = time.time() + self.ttl if self.ttl else None
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value, _ = self._data.pop(key, (default, None))
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class SQLiteCache:
+    """
+    A persistent key/value store for text values in a single SQLite file.
+    Entries are namespaced (e.g. by model name) and, with a `ttl`, ignored once
+    older than `ttl` seconds. Expired rows are deleted when the file is opened and
+    every PURGE_EVERY writes, so the file does not grow without bound.
+    The connection is shared between threads behind a lock.
+    """
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str, namespace: str = "", ttl: float = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL lets several app processes read the file while one of them writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "namespace TEXT NOT NULL, key BLOB NOT NULL, value TEXT NOT NULL, stored_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self.purge()
+
+    def get(self, key, default=None):
+        oldest = time.time() - self.ttl if self.ttl else 0
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ? AND stored_at >= ?", (self.namespace, key, oldest)
+            ).fetchone()
+        return default if row is None else row[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, stored_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, value, time.time()),
+            )
+            self._writes += 1
+            due = self._writes % self.PURGE_EVERY == 0
+        if due:
+            self.purge()
+
+    def purge(self):
+        """Deletes every expired entry, in all namespaces."""
+        if not self.ttl:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE stored_at < ?", (time.time() - self.ttl,))
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Module-level so it outlives individual handlers; keyed on the Neo4j URI.
+_SCHEMA_CACHE = LRUCache(maxsize=8, ttl=SCHEMA_CACHE_TTL_SECONDS)
+
 class GraphQueryHandler:
     def __init__(self):
         try:
-            self.graph = Neo4jGraph(
-                url=os.getenv("NEO4J_URI", "bolt://localhost:7687"),
-                username=os.getenv("NEO4J_USERNAME", "neo4j"),
-                password=os.getenv("NEO4J_PASSWORD", "password")
-            )
-            self.concise_schema = self.get_concise_schema()
-            self.llm = Ollama(model="devstral:24b", temperature=0)
-
-            ### NEW: INITIALIZE ALL REQUIRED CHAINS ###
-            self.router_chain = (
-                PromptTemplate.from_template(ROUTER_TEMPLATE) | self.llm | StrOutputParser()
-            )
-            self.cypher_chain = (
-                PromptTemplate.from_template(CYPHER_GENERATION_TEMPLATE) | self.llm | StrOutputParser()
-            )
-            self.explanation_chain = (
-                PromptTemplate.from_template(EXPLANATION_TEMPLATE) | self.llm | StrOutputParser()
+            uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+            self._neo4j_uri = uri
+            user = os.getenv("NEO4J_USERNAME", "neo4j")
+            password = os.getenv("NEO4J_PASSWORD", "password")
+            self.driver = GraphDatabase.driver(
+                uri,
+                auth=(user, password),
+                max_connection_pool_size=NEO4J_MAX_CONNECTION_POOL_SIZE,
+                connection_acquisition_timeout=NEO4J_CONNECTION_ACQUISITION_TIMEOUT,
             )
+            self.driver.verify_connectivity()
+            self.concise_schema = None
+            self.schema_version = None
+            self._entity_pattern_lock = threading.Lock()
+            self.get_concise_schema()
+            self._query_cache = LRUCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL_SECONDS)
+            self._inflight = {}
+            self._inflight_lock = threading.Lock()
+            # Prompts are filled with str.format and sent over one keep-alive HTTP session
+            self.llm = OllamaClient(model="devstral:24b", temperature=0)
+            self._llm_cache = LRUCache(maxsize=LLM_CACHE_SIZE)
+            self._llm_disk_cache = self._open_llm_disk_cache()
+            # Load the model in the background so the first question does not pay for it
+            threading.Thread(target=self.llm.warm_up, daemon=True).start()
+            self._executor = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS)
 
         except Exception as e:
             raise ConnectionError(f"Failed to initialize GraphQueryHandler: {e}")
 
-    def get_concise_schema(self) -> str:
-        # (This function is unchanged and correct)
-        node_labels = self.graph.query("CALL db.labels() YIELD label RETURN label")
-        relationships = self.graph.query("CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType")
-        schema_str = "Node Labels:\n" + "\n".join([f"- {row['label']}" for row in node_labels])
-        schema_str += "\n\nRelationships:\n" + "\n".join([f"- {row['relationshipType']}" for row in relationships])
+    def _open_llm_disk_cache(self):
+        # The disk tier is an optimisation only; without it completions are still cached in memory
+        if not LLM_DISK_CACHE_PATH:
+            return None
+        try:
+            return SQLiteCache(LLM_DISK_CACHE_PATH, namespace=self.llm.model, ttl=LLM_DISK_CACHE_TTL_SECONDS)
+        except sqlite3.Error:
+            return None
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.llm.close()
+        if self._llm_disk_cache is not None:
+            self._llm_disk_cache.close()
+        self.driver.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_session(self):
+        # Read mode lets a cluster route the session to a follower, and makes Neo4j reject
+        # any write an LLM-generated query might attempt
+        return self.driver.session(fetch_size=FETCH_SIZE, default_access_mode=READ_ACCESS)
+
+    def _read(self, query: str, params: dict, consume):
+        """
+        Runs `query` in a managed read transaction and returns consume(result).
+        The driver retries the whole transaction on transient errors (e.g. a leader switch).
+        """
+        with self._read_session() as session:
+            return session.execute_read(lambda tx: consume(tx.run(query, params or {})))
+
+    def extract_result_for_query(self, query: str, params: dict = None) -> list:
+        """
+        Runs a Cypher query and returns every record as a dict.
+        Values should be passed through `params` ($name placeholders) rather than
+        interpolated into the query, so Neo4j can reuse the cached plan.
+        """
+        return self._read(query, params, lambda result: [record.data() for record in result])
+
+    def extract_dataframe_for_query(self, query: str, params: dict = None) -> "pd.DataFrame":
+        """
+        Runs a Cypher query and returns the result as a pandas DataFrame.
+        The frame is built column-wise by the driver, skipping the per-row dicts
+        that extract_result_for_query allocates.
+        """
+        return self._read(query, params, lambda result: result.to_df())
+
+    def extract_column_for_query(self, query: str, column: str, params: dict = None) -> list:
+        """
+        Runs a Cypher query and returns a single column as a flat list.
+        Cheaper than extract_result_for_query when only one value per record is used,
+        since no per-record dict is built.
+        """
+        return self._read(query, params, lambda result: result.value(column))
+
+    def stream_result_for_query(self, query: str, params: dict = None):
+        """
+        Lazily yields the scalar `name` column of a Cypher query.
+        Records are pulled from the server FETCH_SIZE at a time, so callers that
+        only need the first few rows never materialize the full result set.
+        The query should project `name` directly (e.g. `RETURN c.name AS name`)
+        rather than returning whole nodes.
+        """
+        # A generator cannot run inside a managed transaction, so this uses an auto-commit read
+        with self._read_session() as session:
+            for record in session.run(query, params or {}):
+                yield record["name"]
+
+    def get_concise_schema(self, refresh: bool = False) -> str:
+        """
+        Returns the label/relationship summary of the graph. The schema is static for
+        the lifetime of a session, so it is fetched once and served from
+        `self.concise_schema` afterwards; pass refresh=True to re-query Neo4j.
+        Freshly constructed handlers reuse a summary another handler fetched from the
+        same database within SCHEMA_CACHE_TTL_SECONDS.
+        """
+        if self.concise_schema is not None and not refresh:
+            return self.concise_schema
+        schema_str = None if refresh else _SCHEMA_CACHE.get(self._neo4j_uri)
+        if schema_str is None:
+            node_labels = self.extract_column_for_query(LABELS_QUERY, "label")
+            relationships = self.extract_column_for_query(RELATIONSHIP_TYPES_QUERY, "relationshipType")
+            schema_str = "Node Labels:\n" + "\n".join([f"- {label}" for label in node_labels])
+            schema_str += "\n\nRelationships:\n" + "\n".join([f"- {rel_type}" for rel_type in relationships])
+            _SCHEMA_CACHE.set(self._neo4j_uri, schema_str)
+        self.concise_schema = schema_str
+        self.reset_entity_names()
+        # Everything in the Cypher prompts except the question is fixed until the schema changes
+        self._cypher_prompt = bind_template(CYPHER_GENERATION_PROMPT, schema=schema_str, examples=CYPHER_EXAMPLES_TEXT)
+        self._fetch_code_prompt = bind_template(CYPHER_GENERATION_PROMPT, schema=schema_str, examples="")
+        # Part of the run_query cache key, so cached answers are dropped if the schema changes
+        self.schema_version = hashlib.sha256(schema_str.encode()).hexdigest()
         return schema_str
 
+    @staticmethod
+    def _llm_cache_key(prompt: str) -> bytes:
+        # Hashing keeps multi-KB prompts (schema, source code) out of the cache's keys.
+        # blake2b is faster than sha256 on long inputs, and 16 raw bytes are plenty for a cache key
+        return hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+
+    def _cached_completion(self, key: bytes):
+        """Looks a completion up in memory, then on disk; returns None on a miss."""
+        completion = self._llm_cache.get(key)
+        if completion is None and self._llm_disk_cache is not None:
+            try:
+                completion = self._llm_disk_cache.get(key)
+            except sqlite3.Error:
+                completion = None
+            if completion is not None:
+                self._llm_cache.set(key, completion)
+        return completion
+
+    def _store_completion(self, key: bytes, completion: str):
+        self._llm_cache.set(key, completion)
+        if self._llm_disk_cache is not None:
+            try:
+                self._llm_disk_cache.set(key, completion)
+            except sqlite3.Error:
+                pass  # e.g. a read-only or full disk; the in-memory entry is enough
+
+    def _forget_completion(self, prompt: str):
+        """Drops a cached completion, so the prompt is sent to the LLM again next time."""
+        key = self._llm_cache_key(prompt)
+        self._llm_cache.pop(key)
+        if self._llm_disk_cache is not None:
+            try:
+                self._llm_disk_cache.delete(key)
+            except sqlite3.Error:
+                pass
+
+    def _invoke_llm(self, prompt: str) -> str:
+        """Sends a prompt to the LLM, serving repeated prompts from the completion cache."""
+        key = self._llm_cache_key(prompt)
+        completion = self._cached_completion(key)
+        if completion is None:
+            # Identical prompts already in flight (e.g. two sessions explaining the same
+            # method) wait for that request instead of sending their own
+            completion = self._coalesce(("llm", key), self._generate_and_cache, key, prompt)
+        return completion
+
+    def _generate_and_cache(self, key: str, prompt: str) -> str:
+        completion = self.llm.generate(prompt)
+        # Cached before the in-flight entry is released, so no caller can miss both
+        self._store_completion(key, completion)
+        return completion
+
+    def _generate_cypher(self, prompt: str) -> tuple:
+        """
+        Streams a Cypher completion and sanity-checks it. The opening characters are
+        checked as soon as they arrive, and a reply that does not start like a query is
+        abandoned there instead of waiting for the model to finish it.
+        Returns (query, error_message); error_message is None if the query looks valid.
+        """
+        key = self._llm_cache_key(prompt)
+        completion = self._cached_completion(key)
+        if completion is None:
+            chunks = []
+            head_checked = False
+            stream = self.llm.generate_stream(prompt)
+            try:
+                for chunk in stream:
+                    chunks.append(chunk)
+                    if not head_checked:
+                        head = _strip_code_fences("".join(chunks))
+                        if len(head) >= CYPHER_HEAD_CHARS:
+                            head_checked = True
+                            if not _CYPHER_START.match(head):
+                                return head, _CYPHER_START_ERROR
+            finally:
+                # Closing the stream drops the connection, which stops Ollama generating
+                stream.close()
+            completion = "".join(chunks)
+            self._store_completion(key, completion)
+        query = _strip_code_fences(completion)
+        return query, _cheap_cypher_sanity(query)
+
+    def reset_entity_names(self):
+        """Forgets the known entity names; they are re-read from the graph the next time a question needs them."""
+        with self._entity_pattern_lock:
+            self._entity_pattern = None
+
+    def _get_entity_pattern(self):
+        """
+        Compiles one regex matching any known entity name as a whole word.
+        Built on first use and reused for ENTITY_NAMES_TTL_SECONDS or until
+        reset_entity_names(), so each question is matched in a single pass
+        instead of per name.
+        """
+        # (pattern, expires_at), replaced as a whole so readers never see a mismatched pair
+        cached = self._entity_pattern
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0]
+        # Checked again under the lock, so concurrent questions load the names once
+        with self._entity_pattern_lock:
+            cached = self._entity_pattern
+            if cached is None or time.monotonic() >= cached[1]:
+                names = set(self.extract_column_for_query(ENTITY_NAMES_QUERY, "name"))
+                if not names:
+                    pattern = _NO_ENTITY_NAMES
+                else:
+                    # Longest first, so a name is preferred over any shorter name it contains
+                    alternation = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+                    pattern = re.compile(rf"(?<!\w)(?:{alternation})(?!\w)")
+                cached = self._entity_pattern = (pattern, time.monotonic() + ENTITY_NAMES_TTL_SECONDS)
+            return cached[0]
+
+    def _match_entities(self, question: str) -> list:
+        """Known entity names that appear verbatim in `question`, without duplicates."""
+        return list(dict.fromkeys(self._get_entity_pattern().findall(question)))
+
+    def identify_intent(self, question: str) -> str:
+        """Classifies an expert-mode question; returns JSON of the form {"intent": "dependency" | "entity"}."""
+        if _DEPENDENCY_QUESTION.search(question):
+            return _INTENT_RESPONSES["dependency"]
+        label = self._invoke_llm(render_template(INTENT_PROMPT, question=question)).strip().lower()
+        return _INTENT_RESPONSES["dependency" if "dependency" in label else "entity"]
+
+    def analyze_question(self, question: str) -> tuple:
+        """
+        Works out both the intent (as identify_intent) and the code entities an expert-mode
+        question refers to, with at most one LLM round-trip.
+        Returns (intent_json, entities), entities being a comma-separated string.
+        Questions recognised as dependency questions by their wording skip the LLM entirely,
+        since entities are not used for them; entities is then an empty string. If the entities
+        are found locally only the intent is asked for; otherwise both are asked for in one prompt.
+        """
+        if _DEPENDENCY_QUESTION.search(question):
+            return _INTENT_RESPONSES["dependency"], ""
+        matches = self._match_entities(question)
+        if matches:
+            return self.identify_intent(question), ", ".join(matches)
+        reply = self._invoke_llm(render_template(ANALYZE_QUESTION_PROMPT, question=question))
+        fields = {name.lower(): value for name, value in _ANALYSIS_FIELD.findall(reply)}
+        intent = "dependency" if "dependency" in fields.get("intent", "").lower() else "entity"
+        return _INTENT_RESPONSES[intent], fields.get("entities", "")
+
+    def explain_code(self, source_code: str) -> str:
+        """
+        Asks the LLM to explain a single piece of source code. Source too large for the
+        context window gets SOURCE_TOO_LARGE_EXPLANATION instead, so one oversize class
+        does not fail an answer covering several.
+        """
+        try:
+            return self._invoke_llm(render_template(EXPLANATION_PROMPT, source_code=source_code))
+        except PromptTooLongError:
+            return SOURCE_TOO_LARGE_EXPLANATION
+
+    def explain_code_stream(self, source_code: str):
+        """Like explain_code, but yields the explanation in chunks as the LLM generates it."""
+        prompt = render_template(EXPLANATION_PROMPT, source_code=source_code)
+        key = self._llm_cache_key(prompt)
+        cached = self._cached_completion(key)
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        try:
+            for chunk in self.llm.generate_stream(prompt):
+                chunks.append(chunk)
+                yield chunk
+        except PromptTooLongError:
+            # Raised before the request is sent, so nothing has been yielded yet
+            yield SOURCE_TOO_LARGE_EXPLANATION
+            return
+        self._store_completion(key, "".join(chunks))
+
+    def explain_codes_as_completed(self, source_codes: list):
+        """
+        Explains several pieces of source code concurrently on the handler's thread pool.
+        Yields (index, explanation) pairs in completion order, so callers can render each
+        result as soon as it is ready and one slow explanation does not hold back the rest.
+        """
+        futures = {self._executor.submit(self.explain_code, code): i for i, code in enumerate(source_codes)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
     ### REFACTORED: run_query is now the main orchestrator/router ###
     def run_query(self, question: str):
         """
         Orchestrates the query process by first classifying the user's intent
         and then routing to the appropriate handler.
+        The returned dict carries a `kind` tag ("table", "empty", "markdown" or "error")
+        describing what `result` holds, so callers can dispatch without type checks.
         """
-        start_time = time.time()
-        
+        start_time = time.perf_counter()
+
+        # Repeated questions against an unchanged schema skip the LLM and Neo4j entirely
+        cache_key = (question, self.schema_version)
+        result = self._query_cache.get(cache_key)
+        if result is None:
+            # The same question submitted again while it is still being answered
+            # (e.g. button click plus Enter) waits for the first run instead of repeating it
+            result = self._coalesce(("run_query", *cache_key), self._route_question, question)
+            if self._is_cacheable(result):
+                self._query_cache.set(cache_key, result)
+
+        duration = time.perf_counter() - start_time
+        logger.debug("Answered %r (%s) in %.2fs", question, result["kind"], duration)
+        return {**result, "duration_seconds": round(duration, 2)}
+
+    async def arun_query(self, question: str):
+        """
+        Awaitable variant of run_query for async callers (e.g. async Gradio handlers).
+        The blocking LLM and Neo4j calls run in a worker thread so the event loop
+        keeps serving other sessions meanwhile.
+        """
+        return await asyncio.to_thread(self.run_query, question)
+
+    async def aexplain_code(self, source_code: str) -> str:
+        """
+        Awaitable variant of explain_code. It runs on the handler's LLM pool rather than
+        asyncio's default executor, so an async caller fanning out many explanations is
+        held to LLM_MAX_WORKERS concurrent requests, like explain_codes_as_completed.
+        """
+        return await asyncio.wrap_future(self._executor.submit(self.explain_code, source_code))
+
+    async def aexplain_code_stream(self, source_code: str):
+        """
+        Async-iterable variant of explain_code_stream. One worker thread drains the
+        blocking stream and hands each chunk to the event loop, rather than every
+        chunk costing its own to_thread round-trip.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        stopped = threading.Event()
+
+        def pump():
+            stream = self.explain_code_stream(source_code)
+            item = None
+            try:
+                for chunk in stream:
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            except Exception as e:
+                item = e
+            finally:
+                stream.close()
+            if not stopped.is_set():
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+
+        loop.run_in_executor(None, pump)
+        try:
+            # Chunks are strings; None marks the end of the stream and an exception a failure
+            while isinstance(item := await chunks.get(), str):
+                yield item
+            if item is not None:
+                raise item
+        finally:
+            # If the consumer stops early, the worker exits at its next chunk and closes the stream
+            stopped.set()
+
+    async def aanalyze_question(self, question: str) -> tuple:
+        """Awaitable variant of analyze_question; see arun_query."""
+        return await asyncio.to_thread(self.analyze_question, question)
+
+    async def aextract_dataframe_for_query(self, query: str, params: dict = None) -> "pd.DataFrame":
+        """Awaitable variant of extract_dataframe_for_query; see arun_query."""
+        return await asyncio.to_thread(self.extract_dataframe_for_query, query, params)
+
+    def _route_question(self, question: str) -> dict:
         # Step 1: Use the router to determine the user's intent
-        intent = self.router_chain.invoke({"question": question}).strip().lower()
+        reply = self._invoke_llm(render_template(ROUTER_PROMPT, question=question)).strip().lower()
+        label = _ROUTER_LABEL.search(reply)
+        intent = label.group(1) if label else reply
 
         intermediate_steps = [{"recognized_intent": intent}]
 
         # Step 2: Route to the appropriate handler based on intent
         if intent == 'method_explanation':
-            result = self._handle_method_explanation(question, intermediate_steps)
+            return self._handle_method_explanation(question, intermediate_steps)
         elif intent == 'cypher_lookup':
-            result = self._handle_cypher_lookup(question, intermediate_steps)
-        else:
-            result = {
-                "result": "I'm sorry, I can only answer questions to find code entities or to explain specific methods.",
-                "intermediate_steps": intermediate_steps
-            }
-        
-        # Add duration and return
-        result["duration_seconds"] = round(time.time() - start_time, 2)
-        return result
+            return self._handle_cypher_lookup(question, intermediate_steps)
+        return {
+            "kind": "error",
+            "result": "I'm sorry, I can only answer questions to find code entities or to explain specific methods.",
+            "intermediate_steps": intermediate_steps
+        }
+
+    def _coalesce(self, key, fn, *args):
+        """
+        Runs fn(*args) at most once at a time per key. Callers arriving with the same key
+        while a call is in flight block on that call and share its result (or exception).
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._inflight[key] = Future()
+        if not is_leader:
+            return future.result()
+        try:
+            result = fn(*args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    @staticmethod
+    def _is_cacheable(result: dict) -> bool:
+        """Only successful answers are cached, and tables only up to QUERY_CACHE_MAX_ROWS."""
+        if result["kind"] == "table":
+            return len(result["result"]) <= QUERY_CACHE_MAX_ROWS
+        return result["kind"] != "error"
 
     ### NEW: Handler for cypher lookups (contains your original logic) ###
     def _handle_cypher_lookup(self, question: str, intermediate_steps: list, max_retries: int = 1):
@@ -146,34 +857,31 @@ class GraphQueryHandler:
         retries = 0
         error_message = ""
         generated_cypher = ""
-        
-        # Your original few-shot examples are perfect for this path.
-        examples = [
-            { "question": "Find all classes in the repository 'exampleRepo'.", "query": "MATCH (r:Repository {name: 'exampleRepo'})-[:HAS_CLASSES]->(c:Class) RETURN c.name AS ClassName, c.file_path AS FilePath" },
-            { "question": "Which repositories depend on 'core-library'?", "query": "MATCH (r:Repository)-[:DEPENDS_ON]->(:Repository {name: 'core-library'}) RETURN r.name AS DependentRepository" },
-            { "question": "What are the controllers in 'api-gateway'?", "query": "MATCH (:Repository {name: 'api-gateway'})-[:HAS_ROUTES]->(c:Controller) RETURN c.name AS ControllerName" }
-        ]
-        example_text = "\n\n".join([f"Question: {ex['question']}\nCypher: {ex['query']}" for ex in examples])
+
+        # The prompt does not change between retries, so it is only built once
+        prompt = render_template(self._cypher_prompt, question=question)
+        attempt_prompt = prompt
 
         while retries <= max_retries:
-            generated_cypher = self.cypher_chain.invoke({
-                "schema": self.concise_schema,
-                "examples": example_text,
-                "question": question,
-                "error_correction": "" # No self-correction for simplicity in this path for now
-            }).strip()
+            generated_cypher, error_message = self._generate_cypher(attempt_prompt)
             
             intermediate_steps.append({"cypher_query_generation_attempt": generated_cypher})
-            try:
-                # Execute the query
-                result = self.graph.query(generated_cypher)
-                intermediate_steps.append({"status": "Success"})
-                return {"result": result, "intermediate_steps": intermediate_steps}
-            except Exception as e:
-                retries += 1
-                error_message = str(e)
+            # Obviously malformed output goes straight to a corrected retry without a Neo4j round-trip
+            if error_message is None:
+                try:
+                    # Execute the query
+                    result = self.extract_dataframe_for_query(*_parameterize_literals(generated_cypher))
+                    intermediate_steps.append({"status": "Success"})
+                    return {"kind": "empty" if result.empty else "table", "result": result, "intermediate_steps": intermediate_steps}
+                except Exception as e:
+                    error_message = str(e)
+            # A query that failed is not kept, so the next time this question is asked the
+            # model is queried again instead of replaying the same broken Cypher
+            self._forget_completion(attempt_prompt)
+            retries += 1
+            attempt_prompt = prompt + render_template(ERROR_CORRECTION_PROMPT, query=generated_cypher, error=error_message)
         
-        return {"result": f"Failed to execute a valid query. Last error: {error_message}", "intermediate_steps": intermediate_steps}
+        return {"kind": "error", "result": f"Failed to execute a valid query. Last error: {error_message}", "intermediate_steps": intermediate_steps}
 
     ### NEW: Handler for method explanations ###
     def _handle_method_explanation(self, question: str, intermediate_steps: list):
@@ -184,30 +892,23 @@ class GraphQueryHandler:
         """
         # Step 1: Generate Cypher to get the source code
         # We don't need few-shot examples here as the task is very specific.
-        fetch_code_cypher = self.cypher_chain.invoke({
-            "schema": self.concise_schema,
-            "examples": "", # No examples needed for this targeted task
-            "question": question,
-            "error_correction": ""
-        }).strip()
+        fetch_code_cypher = _strip_code_fences(self._invoke_llm(render_template(self._fetch_code_prompt, question=question)))
 
         intermediate_steps.append({"fetch_code_cypher": fetch_code_cypher})
 
         # Step 2: Execute the query to get the code
         try:
-            code_data = self.graph.query(fetch_code_cypher)
+            code_data = self.extract_result_for_query(*_parameterize_literals(fetch_code_cypher))
             if not code_data or 'source_code' not in code_data[0]:
-                return {"result": "I found the method, but I couldn't retrieve its source code to explain.", "intermediate_steps": intermediate_steps}
+                return {"kind": "error", "result": "I found the method, but I couldn't retrieve its source code to explain.", "intermediate_steps": intermediate_steps}
             
             source_code = code_data[0]['source_code']
             intermediate_steps.append({"status": "Source code retrieved successfully."})
 
-            # Step 3: Use the explanation chain to summarize the code
-            explanation = self.explanation_chain.invoke({
-                "source_code": source_code
-            })
+            # Step 3: Ask the LLM to summarize the code
+            explanation = self.explain_code(source_code)
             
-            return {"result": explanation, "intermediate_steps": intermediate_steps}
+            return {"kind": "markdown", "result": explanation, "intermediate_steps": intermediate_steps}
 
         except Exception as e:
-            return {"result": f"An error occurred. I may have generated a bad query to find the method. Error: {e}", "intermediate_steps": intermediate_steps}
+            return {"kind": "error", "result": f"An error occurred. I may have generated a bad query to find the method. Error: {e}", "intermediate_steps": intermediate_steps}
@@ -0,0 +1,144 @@
+# ollama_client.py
+
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    # orjson parses the (often multi-KB) replies and serializes the prompts several times faster than the stdlib
+    from orjson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    import json
+    from json import loads as json_loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+# (connect, read) timeouts in seconds; long generations from a 24B model need a generous read timeout.
+OLLAMA_TIMEOUT = (3, 300)
+
+# How long Ollama keeps the model loaded after a request. Its default (5m) unloads the
+# model between bursts of questions, so the next prompt pays the full model load again.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Keep-alive connections held per host. Sized above the handler's LLM worker pool plus
+# concurrent UI sessions, so parallel prompts never queue for a free socket.
+OLLAMA_POOL_MAXSIZE = 32
+
+# Context window requested from Ollama. Ollama silently drops the start of a prompt that does
+# not fit, so prompts over OLLAMA_MAX_PROMPT_TOKENS (leaving room for the reply) are refused
+# before they are sent.
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+OLLAMA_MAX_PROMPT_TOKENS = int(os.getenv("OLLAMA_MAX_PROMPT_TOKENS", str(OLLAMA_NUM_CTX * 3 // 4)))
+# Rough characters per token for code and English; used instead of loading the model's tokenizer
+CHARS_PER_TOKEN = 4
+
+# Retries for connection failures, a full request queue (Ollama answers 503 once OLLAMA_MAX_QUEUE
+# is reached), rate limiting and gateway errors (e.g. a proxy in front of Ollama), with exponential
+# backoff (0.5s, 1s, 2s, ...) that honours Retry-After. Other 4xx answers are not retried, nor is a
+# plain 500, which Ollama returns for model-load and out-of-memory failures that a retry repeats.
+# Read errors are not retried either: a non-streaming reply only arrives once generation finishes,
+# so a read timeout means a stalled generation, and retrying it would wait out the full timeout again.
+# Prompts are sent with temperature 0, so re-POSTing one is safe.
+OLLAMA_RETRY_OPTIONS = dict(
+    total=4,
+    read=0,
+    backoff_factor=0.5,
+    backoff_max=30,
+    status_forcelist=[429, 502, 503, 504],
+    allowed_methods=frozenset({"POST"}),
+    respect_retry_after_header=True,
+)
+try:
+    # Jitter keeps clients that failed together from retrying in lockstep (urllib3 2.x only)
+    OLLAMA_RETRY = Retry(**OLLAMA_RETRY_OPTIONS, backoff_jitter=0.25)
+except TypeError:
+    OLLAMA_RETRY_OPTIONS.pop("backoff_max")
+    OLLAMA_RETRY = Retry(**OLLAMA_RETRY_OPTIONS)
+
+class PromptTooLongError(ValueError):
+    """Raised instead of sending a prompt that would not fit in the model's context window."""
+
+def count_tokens(prompt: str) -> int:
+    """Estimates the number of tokens in `prompt`."""
+    return -(-len(prompt) // CHARS_PER_TOKEN)
+
+class OllamaClient:
+    """
+    Thin client for Ollama's /api/chat endpoint.
+    Every call goes through one requests.Session, so the TCP connection to the
+    Ollama server is kept alive and reused instead of being reopened per prompt.
+    """
+
+    def __init__(self, model: str, temperature: float = 0.0, base_url: str = OLLAMA_BASE_URL):
+        self.model = model
+        self.temperature = temperature
+        # Identical for every request, so built once and shared by each payload (it is only serialized)
+        self._options = {"temperature": temperature, "num_ctx": OLLAMA_NUM_CTX}
+        # /api/chat rather than /api/generate: generate's final response also carries the
+        # whole tokenized `context`, thousands of ints that would be parsed and thrown away
+        self.chat_url = f"{base_url.rstrip('/')}/api/chat"
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=OLLAMA_POOL_MAXSIZE, max_retries=OLLAMA_RETRY)
+        self._http.mount("http://", adapter)
+        self._http.mount("https://", adapter)
+        # Bodies are serialized by json_dumps rather than requests' stdlib json=, so the type is set here
+        self._http.headers["Content-Type"] = "application/json"
+
+    def _payload(self, prompt: str, stream: bool) -> dict:
+        tokens = count_tokens(prompt)
+        if tokens > OLLAMA_MAX_PROMPT_TOKENS:
+            raise PromptTooLongError(f"Prompt of ~{tokens} tokens exceeds the limit of {OLLAMA_MAX_PROMPT_TOKENS}.")
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": stream,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": self._options,
+        }
+
+    def generate(self, prompt: str) -> str:
+        """Returns the model's full completion for `prompt`."""
+        response = self._http.post(self.chat_url, data=json_dumps(self._payload(prompt, False)), timeout=OLLAMA_TIMEOUT)
+        response.raise_for_status()
+        return json_loads(response.content)["message"]["content"]
+
+    def generate_stream(self, prompt: str):
+        """Yields the completion for `prompt` in chunks as the model produces them."""
+        with self._http.post(self.chat_url, data=json_dumps(self._payload(prompt, True)), stream=True, timeout=OLLAMA_TIMEOUT) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json_loads(line)
+                content = chunk.get("message", {}).get("content")
+                if content:
+                    yield content
+                if chunk.get("done"):
+                    break
+
+    def warm_up(self) -> bool:
+        """
+        Loads the model on the server and opens a pooled connection, without generating
+        anything (Ollama treats a chat request with no messages as a load request).
+        Returns False instead of raising if the server cannot be reached.
+        """
+        # Loaded with the same num_ctx as real requests; a different value would make Ollama reload the model
+        payload = {"model": self.model, "messages": [], "keep_alive": OLLAMA_KEEP_ALIVE, "options": {"num_ctx": OLLAMA_NUM_CTX}}
+        try:
+            self._http.post(self.chat_url, data=json_dumps(payload), timeout=OLLAMA_TIMEOUT).raise_for_status()
+        except requests.RequestException:
+            return False
+        return True
+
+    def close(self):
+        self._http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()